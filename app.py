@@ -1,19 +1,120 @@
-from flask import Flask, send_file
+from flask import Flask, Response, jsonify, request
 from flask_apscheduler import APScheduler
+import click
+import prometheus_client as prom
+from prometheus_client import multiprocess
 import requests
-import pdfplumber
+import httpx
+import pdf_text
+from pdf_text import PDF_TEXT_BACKENDS, available_pdf_text_backends
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import PDFObjRef, PDFStream, resolve1
 import re
 import folium
+from folium.plugins import MarkerCluster
 import time
 import traceback
-from collections import defaultdict
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from geopy.geocoders import ArcGIS
+from geopy.exc import (
+    ConfigurationError, GeocoderAuthenticationFailure, GeocoderInsufficientPrivileges,
+    GeocoderQuotaExceeded, GeocoderRateLimited, GeocoderServiceError, GeocoderTimedOut,
+    GeocoderUnavailable,
+)
 import io
 import os
+import sys
+import sqlite3
+import threading
+import asyncio
+import queue
+import json
+import math
+import mmap
+import struct
+import hashlib
+import multiprocessing
+import fcntl
+import gzip
+import random
+import string
+import tempfile
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+try:
+    import h2
+except ImportError:  # optional; httpx falls back to HTTP/1.1 keep-alive
+    h2 = None
 
 PDF_URL = "https://www.nyc.gov/html/dot/downloads/pdf/concretesch.pdf"
 NYC_CENTRE = [40.7128, -74.0060]
-MAP_FILE = "latest_map.html"
+BOROUGH_COLOURS = defaultdict(
+    lambda: "gray",
+    {
+        "Bronx": "red",
+        "Brooklyn": "blue",
+        "Manhattan": "green",
+        "Queens": "orange",
+        "Staten Island": "purple"
+    }
+)
+# "leaflet": / is a static page drawing /api/segments.geojson; "folium" or "template": a
+# self-contained map page rendered by the pipeline
+MAP_RENDERER = os.environ.get("MAP_RENDERER", "leaflet")
+MAP_DIR = os.environ.get("MAP_DIR", "maps")
+MAP_VERSIONS_KEPT = 3
+MAP_POINTER_POLL_SECONDS = 5
+# /ready reports a fresh map if the schedule was checked within this many seconds
+MAP_FRESH_SECONDS = int(os.environ.get("MAP_FRESH_SECONDS", str(2 * 3600)))
+LEADER_LOCK_FILE = os.environ.get("LEADER_LOCK_FILE", "pipeline.lock")
+LEADER_POLL_SECONDS = 30
+PIPELINE_STATUS_FILE = "pipeline_status.json"
+REFRESH_REQUEST_FILE = "refresh.request"
+PDF_STATE_FILE = "pdf_state.json"
+PARSE_CACHE_DIR = os.environ.get("PARSE_CACHE_DIR", "parse_cache")
+PARSE_CACHE_MAX_ENTRIES = 8
+PAGE_CACHE_FILE = os.environ.get("PAGE_CACHE_FILE", "page_cache.json")
+PAGE_CACHE_MAX_ENTRIES = 500
+GEOCODE_CACHE_FILE = os.environ.get("GEOCODE_CACHE_FILE", "geocode_cache.sqlite3")
+GEOCODE_CACHE_TTL = 30 * 24 * 3600          # seconds a successful lookup stays valid
+GEOCODE_CACHE_NEGATIVE_TTL = 24 * 3600      # seconds a "no result" lookup stays valid
+GEOCODE_CACHE_STALE_TTL = 180 * 24 * 3600   # seconds an expired point is kept for outages
+GEOCODE_CACHE_MAX_ENTRIES = 20000
+GEOCODE_CACHE_TOUCH_COMMIT_SECONDS = 5     # how long recency updates may wait for a commit
+GEOCODE_CONCURRENCY = int(os.environ.get("GEOCODE_CONCURRENCY", "8"))
+GEOCODE_RATE_PER_SEC = float(os.environ.get("GEOCODE_RATE_PER_SEC", "10"))
+GEOCODE_TRIES = 3
+GEOCODE_BACKOFF_BASE = 0.5   # seconds before the first retry; doubles per retry, with jitter
+GEOCODE_BACKOFF_MAX = 30
+# Consecutive failed lookups after which a remote backend is skipped for the rest of the run
+GEOCODE_BREAKER_THRESHOLD = int(os.environ.get("GEOCODE_BREAKER_THRESHOLD", "10"))
+# Comma-separated fallback chain, tried in order: "centerline", "arcgis", "arcgis-async",
+# "arcgis-batch"
+GEOCODER_BACKENDS = os.environ.get("GEOCODER_BACKENDS", "centerline,arcgis")
+# GeocodeServer root used by the httpx clients; point it at a stub server for testing
+ARCGIS_URL = os.environ.get(
+    "ARCGIS_URL", "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer"
+).rstrip("/")
+# Required by geocodeAddresses ("arcgis-batch"); also sent with single lookups when set
+ARCGIS_API_KEY = os.environ.get("ARCGIS_API_KEY")
+# Addresses per geocodeAddresses request when the service does not suggest a size
+ARCGIS_BATCH_SIZE = int(os.environ.get("ARCGIS_BATCH_SIZE", "150"))
+CENTERLINE_FILE = os.environ.get("CENTERLINE_FILE", "lion.geojson")
+CENTERLINE_INDEX_FILE = os.environ.get("CENTERLINE_INDEX_FILE", "intersections.idx")
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "4"))
+PDF_PAGE_CHUNK = 8  # most pages per extraction task, so rows start flowing before the last page
+# Items buffered between streaming pipeline stages before the producer waits
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "256"))
+# "pdfplumber", "pypdfium2", or "layout" (pdfplumber word boxes assigned to columns)
+PDF_TEXT_BACKEND = os.environ.get("PDF_TEXT_BACKEND", "pdfplumber")
 
 app = Flask(__name__)
 
@@ -24,164 +125,1893 @@ app.config.from_object(Config())
 
 scheduler = APScheduler()
 scheduler.init_app(app)
-scheduler.start()
 
-def download_latest_pdf():
+# Under gunicorn, set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates every worker
+STAGE_SECONDS = prom.Histogram(
+    "concrete_map_stage_seconds", "Duration of each map pipeline stage", ["stage"],
+    buckets=(0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+PIPELINE_SKIPS = prom.Counter(
+    "concrete_map_pipeline_skips", "Pipeline runs skipped because the schedule was unchanged", ["reason"]
+)
+ROWS_PARSED = prom.Counter("concrete_map_rows_parsed", "Schedule rows extracted from PDFs")
+GEOCODE_CALLS = prom.Counter("concrete_map_geocode_calls", "Geocoder backend lookups", ["backend"])
+GEOCODE_ERRORS = prom.Counter("concrete_map_geocode_errors", "Geocoder lookups that raised", ["backend"])
+GEOCODE_RETRIES = prom.Counter("concrete_map_geocode_retries", "Geocoder lookups retried after an error")
+GEOCODE_CACHE = prom.Counter("concrete_map_geocode_cache", "Geocode cache lookups", ["result"])
+GEOCODE_BREAKER_TRIPS = prom.Counter(
+    "concrete_map_geocode_breaker_trips", "Remote geocoders switched off for the rest of a run", ["backend"]
+)
+GEOCODE_UNRESOLVED = prom.Counter("concrete_map_geocode_unresolved", "Intersections left without a point")
+OUTPUT_BYTES = prom.Counter("concrete_map_output_bytes", "Bytes published", ["artifact", "encoding"])
+PIPELINE_QUEUE_DEPTH = prom.Gauge(
+    "concrete_map_pipeline_queue_depth", "Items waiting between streaming pipeline stages", ["stage"],
+    multiprocess_mode="livesum",
+)
+
+STREET_SUFFIXES = {
+    "STREET": "ST", "AVENUE": "AVE", "ROAD": "RD", "BOULEVARD": "BLVD", "PARKWAY": "PKWY",
+    "PLACE": "PL", "DRIVE": "DR", "COURT": "CT", "HIGHWAY": "HWY", "LANE": "LN",
+    "EXPRESSWAY": "EXPWY",
+}
+
+def normalize_address(addr):
+    return " ".join(addr.upper().split())
+
+def normalize_street(name):
+    words = [re.sub(r"^(\d+)(?:ST|ND|RD|TH)$", r"\1", w) for w in name.upper().replace(".", "").split()]
+    if words:
+        words[-1] = STREET_SUFFIXES.get(words[-1], words[-1])
+    return " ".join(words)
+
+class Intersection(namedtuple("Intersection", "street_a street_b boro")):
+    """Canonical intersection: normalized street names in sorted order, so A & B == B & A."""
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, street, cross_street, boro):
+        a, b = sorted((normalize_street(street), normalize_street(cross_street)))
+        return cls(a, b, boro)
+
+    @property
+    def address(self):
+        return f"{self.street_a} & {self.street_b}, {self.boro}, NY"
+
+class GeocodeCache:
+    """Persistent address -> (lat, lon) cache in SQLite with TTL and least-recently-used eviction.
+
+    A cached ``None`` point records a lookup the geocoder answered with no result, so a warm
+    run does not ask again until ``negative_ttl`` expires. Expired points are kept until
+    ``stale_ttl`` as a fallback for when the geocoders are down.
+
+    New lookups are committed as soon as they are stored, so a crash mid-run loses none of
+    them; the recency updates made by :meth:`get` are committed every few seconds.
+    """
+
+    def __init__(self, path=GEOCODE_CACHE_FILE, ttl=GEOCODE_CACHE_TTL,
+                 negative_ttl=GEOCODE_CACHE_NEGATIVE_TTL, stale_ttl=GEOCODE_CACHE_STALE_TTL,
+                 max_entries=GEOCODE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")  # cheap commits; WAL stays consistent
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocodes ("
+                "address TEXT PRIMARY KEY, lat REAL, lon REAL, "
+                "fetched_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS geocodes_used_at ON geocodes (used_at)")
+        self.committed_at = time.monotonic()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, addr, allow_stale=False):
+        """Return ``(found, point)``; ``point`` is ``None`` for a cached negative lookup.
+
+        With ``allow_stale``, an expired point younger than ``stale_ttl`` is also returned.
+        """
+        key = normalize_address(addr)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT lat, lon, fetched_at FROM geocodes WHERE address = ?", (key,)
+            ).fetchone()
+            if row:
+                lat, lon, fetched_at = row
+                ttl = self.ttl if lat is not None else self.negative_ttl
+                if allow_stale and lat is not None:
+                    ttl = self.stale_ttl
+                if now - fetched_at < ttl:
+                    self.conn.execute("UPDATE geocodes SET used_at = ? WHERE address = ?", (now, key))
+                    if time.monotonic() - self.committed_at >= GEOCODE_CACHE_TOUCH_COMMIT_SECONDS:
+                        self._commit()
+                    if allow_stale:
+                        GEOCODE_CACHE.labels("stale").inc()
+                    else:
+                        self.hits += 1
+                        GEOCODE_CACHE.labels("hit").inc()
+                    return True, (lat, lon) if lat is not None else None
+            if not allow_stale:
+                self.misses += 1
+                GEOCODE_CACHE.labels("miss").inc()
+        return False, None
+
+    def put(self, addr, point):
+        key = normalize_address(addr)
+        lat, lon = point if point else (None, None)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO geocodes (address, lat, lon, fetched_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, lat, lon, now, now),
+            )
+            self._commit()
+
+    def _commit(self):
+        # Caller holds self.lock
+        self.conn.commit()
+        self.committed_at = time.monotonic()
+
+    def flush(self):
+        """Commit pending updates, drop rows too old even as stale fallbacks and trim to ``max_entries``."""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM geocodes WHERE (lat IS NOT NULL AND fetched_at < ?) "
+                "OR (lat IS NULL AND fetched_at < ?)",
+                (now - self.stale_ttl, now - self.negative_ttl),
+            )
+            self.conn.execute(
+                "DELETE FROM geocodes WHERE address IN ("
+                "SELECT address FROM geocodes ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+geocode_cache = GeocodeCache()
+
+class TokenBucket:
+    """Thread-safe token bucket: ``acquire`` blocks until a request may be sent."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Transient failures: timeouts, overloaded or unreachable services, dropped connections
+RETRYABLE_ERRORS = (
+    GeocoderTimedOut, GeocoderUnavailable, GeocoderRateLimited,
+    httpx.TransportError, requests.ConnectionError, requests.Timeout,
+)
+# Failures no retry will fix during this run (bad credentials, exhausted quota, bad setup)
+FATAL_ERRORS = (
+    GeocoderAuthenticationFailure, GeocoderInsufficientPrivileges, GeocoderQuotaExceeded,
+    ConfigurationError,
+)
+ARCGIS_FATAL_CODES = {401, 403, 498, 499}  # missing, invalid or unauthorized token
+
+def _error_status(error):
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    if isinstance(error, ArcGISError) and isinstance(error.code, int):
+        return error.code
+    return None
+
+def is_retryable(error):
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    status = _error_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    # geopy raises the bare GeocoderServiceError for unexpected HTTP statuses
+    return type(error) is GeocoderServiceError
+
+def is_fatal(error):
+    if is_retryable(error):
+        return False
+    return isinstance(error, FATAL_ERRORS) or _error_status(error) in ARCGIS_FATAL_CODES
+
+class RetryPolicy:
+    """Retries retryable errors with exponential backoff and full jitter; others raise at once."""
+
+    def __init__(self, tries=GEOCODE_TRIES, base=GEOCODE_BACKOFF_BASE, cap=GEOCODE_BACKOFF_MAX):
+        self.tries = tries
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def call(self, fn, *args):
+        for attempt in range(self.tries):
+            try:
+                return fn(*args)
+            except Exception as e:
+                if attempt + 1 == self.tries or not is_retryable(e):
+                    raise
+                GEOCODE_RETRIES.inc()
+                time.sleep(self.delay(attempt))
+
+GEOCODE_RETRY = RetryPolicy()
+
+class CircuitBreaker:
+    """Switches a remote backend off after ``threshold`` consecutive failed lookups.
+
+    A fatal error opens it straight away. Backends are built per run, so an open breaker
+    fast-fails lookups for the rest of that run only.
+    """
+
+    def __init__(self, name, threshold=GEOCODE_BREAKER_THRESHOLD):
+        self.name = name
+        self.threshold = threshold
+        self.failures = 0
+        self.open = False
+        self.lock = threading.Lock()
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+
+    def failure(self, error):
+        with self.lock:
+            self.failures += 1
+            if self.open or (self.failures < self.threshold and not is_fatal(error)):
+                return
+            self.open = True
+        GEOCODE_BREAKER_TRIPS.labels(self.name).inc()
+        print(f"Geocoder {self.name} switched off for the rest of this run "
+              f"({self.failures} consecutive failures, last: {error!r}).")
+
+class ArcGISBackend:
+    """Remote backend wrapping geopy's ArcGIS geocoder, throttled by a shared token bucket."""
+    name = "arcgis"
+    remote = True
+
+    def __init__(self, limiter, timeout=10):
+        self.geocoder = ArcGIS(timeout=timeout)
+        self.limiter = limiter
+        self.breaker = CircuitBreaker(self.name)
+
+    def geocode(self, intersection):
+        self.limiter.acquire()
+        location = self.geocoder.geocode(intersection.address)
+        return (location.latitude, location.longitude) if location else None
+
+class ArcGISError(Exception):
+    """Error object returned by an ArcGIS REST endpoint (often with HTTP status 200)."""
+
+    def __init__(self, code, message):
+        super().__init__(f"ArcGIS error {code}: {message}")
+        self.code = code
+
+def arcgis_json(response):
+    """Decode an ArcGIS REST response, raising for HTTP errors and embedded error objects."""
+    response.raise_for_status()
+    data = response.json()
+    if "error" in data:
+        error = data["error"]
+        raise ArcGISError(error.get("code"), error.get("message"))
+    return data
+
+class AsyncArcGISBackend:
+    """Remote backend calling ``findAddressCandidates`` with httpx on a private event loop.
+
+    All lookups share one pooled ``AsyncClient``, so connections are kept alive across
+    requests (multiplexed over HTTP/2 when ``h2`` is installed). :meth:`geocode` is a blocking
+    wrapper for the pipeline's worker threads. ``base_url`` defaults to ``ARCGIS_URL``.
+    """
+    name = "arcgis-async"
+    remote = True
+
+    def __init__(self, limiter, base_url=None, api_key=ARCGIS_API_KEY, timeout=10,
+                 concurrency=GEOCODE_CONCURRENCY):
+        self.limiter = limiter
+        self.breaker = CircuitBreaker(self.name)
+        self.base_url = base_url or ARCGIS_URL
+        self.params = {"f": "json", "token": api_key} if api_key else {"f": "json"}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="arcgis-async", daemon=True)
+        self.thread.start()
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        self.client = self._run(self._make_client(timeout, limits))
+
+    async def _make_client(self, timeout, limits):
+        # Created on the loop that will use it
+        return httpx.AsyncClient(http2=h2 is not None, timeout=timeout, limits=limits)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def find(self, address):
+        response = await self.client.get(f"{self.base_url}/findAddressCandidates", params={
+            "SingleLine": address, "maxLocations": 1, "outFields": "", **self.params,
+        })
+        candidates = arcgis_json(response).get("candidates")
+        if not candidates:
+            return None
+        location = candidates[0]["location"]
+        return (location["y"], location["x"])
+
+    def geocode(self, intersection):
+        self.limiter.acquire()
+        return self._run(self.find(intersection.address))
+
+    def close(self):
+        self._run(self.client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+class ArcGISBatchBackend(AsyncArcGISBackend):
+    """Async backend that also resolves whole batches through ``geocodeAddresses``.
+
+    :class:`GeocodeEngine` sends misses here ``batch_size`` at a time, falling back to single
+    ``findAddressCandidates`` lookups for addresses a batch did not answer. The ArcGIS World
+    service only accepts batches with a token (``ARCGIS_API_KEY``).
+    """
+    name = "arcgis-batch"
+
+    def __init__(self, limiter, base_url=None, api_key=ARCGIS_API_KEY, timeout=60,
+                 concurrency=GEOCODE_CONCURRENCY):
+        super().__init__(limiter, base_url, api_key, timeout, concurrency)
+        self._batch_size = None
+
+    @property
+    def batch_size(self):
+        """The service's suggested batch size, capped at its maximum, else ``ARCGIS_BATCH_SIZE``."""
+        if self._batch_size is None:
+            try:
+                props = self._run(self.client.get(self.base_url, params=self.params))
+                props = arcgis_json(props).get("locatorProperties") or {}
+            except (httpx.HTTPError, ArcGISError, ValueError) as e:
+                print(f"Could not read ArcGIS locator properties ({e}), using batch size {ARCGIS_BATCH_SIZE}.")
+                props = {}
+            size = props.get("SuggestedBatchSize") or props.get("MaxBatchSize") or ARCGIS_BATCH_SIZE
+            self._batch_size = max(1, min(size, props.get("MaxBatchSize") or size))
+        return self._batch_size
+
+    async def find_batch(self, intersections):
+        records = [
+            {"attributes": {"OBJECTID": i, "SingleLine": intersection.address}}
+            for i, intersection in enumerate(intersections)
+        ]
+        response = await self.client.post(f"{self.base_url}/geocodeAddresses", data={
+            "addresses": json.dumps({"records": records}), **self.params,
+        })
+        points = {}
+        for result in arcgis_json(response).get("locations") or []:
+            attributes = result.get("attributes") or {}
+            i = attributes.get("ResultID")
+            if not isinstance(i, int) or not 0 <= i < len(intersections):
+                continue
+            location = result.get("location") or {}
+            if attributes.get("Status") == "U":
+                points[intersections[i]] = None
+            elif isinstance(location.get("x"), (int, float)) and isinstance(location.get("y"), (int, float)):
+                points[intersections[i]] = (location["y"], location["x"])
+        return points
+
+    def geocode_batch(self, intersections):
+        """Return ``{intersection: point or None}`` for the addresses the batch answered."""
+        self.limiter.acquire()
+        return self._run(self.find_batch(intersections))
+
+class CenterlineIndex:
+    """Offline backend answering intersection lookups from a street-centerline file.
+
+    The centerline GeoJSON (LION-style: one LineString per street segment, split at
+    intersections) is reduced once to a sorted table of ``(key hash, lat, lon)`` records that
+    is memory-mapped and binary-searched, so no network and almost no memory is needed.
+    """
+    name = "centerline"
+    remote = False
+
+    MAGIC = b"CLX1"
+    HEADER = struct.Struct("<4sI")
+    RECORD = struct.Struct("<Qff")
+    STREET_FIELDS = ("Street", "STREET", "full_stree", "FULL_STREE", "stname_label")
+    BORO_FIELDS = ("LBoro", "RBoro", "borocode", "BoroCode", "BOROCODE")
+    BORO_CODES = {"1": "Manhattan", "2": "Bronx", "3": "Brooklyn", "4": "Queens", "5": "Staten Island"}
+
+    def __init__(self, index_path):
+        with open(index_path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = self.HEADER.unpack_from(self.mm, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{index_path} is not an intersection index")
+
+    @classmethod
+    def open(cls, source_path=CENTERLINE_FILE, index_path=CENTERLINE_INDEX_FILE):
+        """Open the index, (re)building it first if the centerline file is newer."""
+        if not os.path.exists(index_path) or (
+            os.path.exists(source_path) and os.path.getmtime(source_path) > os.path.getmtime(index_path)
+        ):
+            cls.build(source_path, index_path)
+        return cls(index_path)
+
+    @staticmethod
+    def key_hash(street_a, street_b, boro):
+        digest = hashlib.blake2b(f"{street_a}|{street_b}|{boro}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    @classmethod
+    def build(cls, source_path, index_path):
+        print(f"Building intersection index from {source_path}...")
+        with open(source_path) as f:
+            features = json.load(f)["features"]
+        nodes = defaultdict(set)  # (lon, lat, boro) -> normalized street names meeting there
+        for feature in features:
+            props = feature.get("properties") or {}
+            geometry = feature.get("geometry") or {}
+            street = next((props[k] for k in cls.STREET_FIELDS if props.get(k)), None)
+            boros = {cls.BORO_CODES.get(str(props.get(k)).strip()) for k in cls.BORO_FIELDS}
+            boros.discard(None)
+            if not street or not boros:
+                continue
+            parts = geometry.get("coordinates") or []
+            if geometry.get("type") == "LineString":
+                parts = [parts]
+            elif geometry.get("type") != "MultiLineString":
+                continue
+            for part in parts:
+                for lon, lat, *_ in (part[0], part[-1]):
+                    for boro in boros:
+                        nodes[(round(lon, 6), round(lat, 6), boro)].add(normalize_street(street))
+        table = {}
+        for (lon, lat, boro), streets in nodes.items():
+            streets = sorted(streets)
+            for i, a in enumerate(streets):
+                for b in streets[i + 1:]:
+                    table.setdefault(cls.key_hash(a, b, boro), (lat, lon))
+        tmp = index_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, len(table)))
+            for key in sorted(table):
+                f.write(cls.RECORD.pack(key, *table[key]))
+        os.replace(tmp, index_path)
+        print(f"Intersection index built: {len(table)} intersections.")
+
+    def geocode(self, intersection):
+        key = self.key_hash(*intersection)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key, lat, lon = self.RECORD.unpack_from(self.mm, self.HEADER.size + mid * self.RECORD.size)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return (lat, lon)
+        return None
+
+def make_geocoder_chain(names=GEOCODER_BACKENDS):
+    backends = []
+    for name in (n.strip() for n in names.split(",") if n.strip()):
+        if name == "arcgis":
+            backends.append(ArcGISBackend(TokenBucket(GEOCODE_RATE_PER_SEC)))
+        elif name == "arcgis-async":
+            backends.append(AsyncArcGISBackend(TokenBucket(GEOCODE_RATE_PER_SEC)))
+        elif name == "arcgis-batch":
+            if not ARCGIS_API_KEY:
+                print("ARCGIS_API_KEY is not set; the World geocoder will reject batch requests.")
+            backends.append(ArcGISBatchBackend(TokenBucket(GEOCODE_RATE_PER_SEC)))
+        elif name == "centerline":
+            if not (os.path.exists(CENTERLINE_FILE) or os.path.exists(CENTERLINE_INDEX_FILE)):
+                print(f"No centerline file at {CENTERLINE_FILE}, skipping offline geocoder.")
+                continue
+            backends.append(CenterlineIndex.open())
+        else:
+            print(f"Unknown geocoder backend {name!r}, ignoring.")
+    return backends
+
+def lookup_local(backends, intersection):
+    """Try local backends, then the cache; return ``(found, point)``."""
+    for backend in backends:
+        if not backend.remote:
+            GEOCODE_CALLS.labels(backend.name).inc()
+            point = backend.geocode(intersection)
+            if point:
+                return True, point
+    return geocode_cache.get(intersection.address)
+
+def geocode_intersection(backends, intersection, policy=GEOCODE_RETRY):
+    """Try local backends, then the cache, then each remote backend with retries."""
+    found, point = lookup_local(backends, intersection)
+    return point if found else geocode_remote(backends, intersection, policy)
+
+def call_remote(backend, fn, *args, policy=GEOCODE_RETRY):
+    """Call ``fn`` under ``policy``, feeding the outcome to the backend's circuit breaker."""
+    def attempt():
+        GEOCODE_CALLS.labels(backend.name).inc()
+        try:
+            return fn(*args)
+        except Exception:
+            GEOCODE_ERRORS.labels(backend.name).inc()
+            raise
+
     try:
-        r = requests.get(PDF_URL, stream=True, timeout=30)
+        result = policy.call(attempt)
+    except Exception as e:
+        backend.breaker.failure(e)
+        raise
+    backend.breaker.success()
+    return result
+
+class GeocodeUnavailable(Exception):
+    """No remote backend answered and there was no expired point to fall back on."""
+
+def geocode_remote(backends, intersection, policy=GEOCODE_RETRY):
+    """Ask each remote backend in turn, caching the first answer.
+
+    Backends whose breaker is open are skipped. If no backend answers, an expired cache
+    entry is better than nothing; without one this raises :class:`GeocodeUnavailable`, so a
+    failed lookup is not mistaken for a "no result" answer.
+    """
+    point = None
+    answered = False
+    for backend in backends:
+        if not backend.remote or backend.breaker.open:
+            continue
+        try:
+            point = call_remote(backend, backend.geocode, intersection, policy=policy)
+        except Exception:
+            continue
+        answered = True
+        if point:
+            break
+    if answered:
+        geocode_cache.put(intersection.address, point)
+        return point
+    point = geocode_cache.get(intersection.address, allow_stale=True)[1]
+    if point is None:
+        raise GeocodeUnavailable(intersection.address)
+    return point
+
+class _BatchedFuture(Future):
+    """Future for a queued batch entry; waiting on it sends the partly filled batch."""
+
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+
+    def result(self, timeout=None):
+        if not self.done():
+            self.engine.flush()
+        return super().result(timeout)
+
+class GeocodeEngine:
+    """Geocodes intersections on a thread pool as they are submitted, once each.
+
+    :meth:`submit` returns a future for the intersection's point; repeats of an intersection
+    share the first future. With a batch backend in the chain, intersections missing from
+    the local backends and cache are queued and sent a batch at a time: when the batch is
+    full, when someone waits on one of its futures, or on :meth:`flush` after the last
+    submit. Use as a context manager so the pool is drained on exit.
+
+    Lookups that fail because no backend answered resolve to ``None`` like a "no result"
+    answer, but are counted in :attr:`failed`.
+    """
+
+    def __init__(self, backends, concurrency=GEOCODE_CONCURRENCY, progress=None, planned=None):
+        self.backends = backends
+        self.batch_backend = next((b for b in backends if hasattr(b, "geocode_batch")), None)
+        self.progress = progress
+        self.planned = planned
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.futures = {}
+        self.batch = []
+        self.batch_lock = threading.Lock()
+        self.closed = False
+        self.endpoints = 0
+        self.failed = 0
+        self.failed_lock = threading.Lock()
+        self.started_at = time.time()
+
+    def submit(self, intersection):
+        self.endpoints += 1
+        future = self.futures.get(intersection)
+        if future is None:
+            if self.planned:
+                self.planned()
+            if self.batch_backend:
+                future = self._submit_batched(intersection)
+            else:
+                future = self.pool.submit(self._geocode, geocode_intersection, intersection)
+            self.futures[intersection] = future
+        return future
+
+    def _submit_batched(self, intersection):
+        found, point = lookup_local(self.backends, intersection)
+        future = _BatchedFuture(self)
+        if found:
+            future.set_result(point)
+            self._advance()
+            return future
+        batch_size = self.batch_backend.batch_size
+        with self.batch_lock:
+            self.batch.append((intersection, future))
+            full = len(self.batch) >= batch_size
+        if full:
+            self.flush()
+        return future
+
+    def flush(self):
+        """Send the partly filled batch, if any."""
+        with self.batch_lock:
+            batch, self.batch = self.batch, []
+        if batch and not self.closed:
+            self.pool.submit(self._geocode_batch, batch)
+
+    def _geocode_batch(self, batch):
+        backend = self.batch_backend
+        points = {}
+        if not backend.breaker.open:
+            try:
+                points = call_remote(backend, backend.geocode_batch, [intersection for intersection, _ in batch])
+            except Exception as e:
+                print(f"Batch of {len(batch)} addresses failed ({e}), geocoding them one by one.")
+        for intersection, future in batch:
+            if intersection in points:
+                geocode_cache.put(intersection.address, points[intersection])
+                future.set_result(points[intersection])
+                self._advance()
+            else:
+                self.pool.submit(self._geocode, geocode_remote, intersection, future)
+
+    def _geocode(self, geocode, intersection, future=None):
+        try:
+            point = geocode(self.backends, intersection)
+        except GeocodeUnavailable:
+            with self.failed_lock:
+                self.failed += 1
+            point = None
+        except BaseException as e:
+            if future is None:
+                raise
+            future.set_exception(e)
+            return
+        if future is not None:
+            future.set_result(point)
+        self._advance()
+        return point
+
+    def _advance(self):
+        if self.progress:
+            self.progress()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            # Batch workers hand misses back to the pool as single lookups, so the pool must
+            # stay open until every future, and with it every fallback, has finished
+            self.flush()
+            wait(self.futures.values())
+        self.closed = True
+        self.pool.shutdown(cancel_futures=exc_type is not None)
+        for backend in self.backends:
+            if hasattr(backend, "close"):
+                backend.close()
+        if exc_type is not None:
+            return
+        STAGE_SECONDS.labels("geocode").observe(time.time() - self.started_at)
+        GEOCODE_UNRESOLVED.inc(sum(
+            future.exception() is not None or future.result() is None for future in self.futures.values()
+        ))
+        if self.futures:
+            print(f"Geocode plan: {self.endpoints} endpoints -> {len(self.futures)} unique intersections "
+                  f"(dedup ratio {self.endpoints / len(self.futures):.2f}x)")
+        if self.failed:
+            print(f"{self.failed} lookups failed with no backend answering.")
+
+def plan_segments(split_rows, engine):
+    """Yield a segment per ``(boro, on_st, from_st, to_st)`` row, submitting its endpoints.
+
+    Each segment is ``(boro, on_st, from_st, to_st, start, end)`` where ``start``/``end`` are
+    futures from ``engine`` (``end`` is ``None`` without a To street).
+    """
+    try:
+        for boro, on_st, from_st, to_st in split_rows:
+            if not (on_st and from_st):
+                continue
+            start = engine.submit(Intersection.of(on_st, from_st, boro))
+            end = engine.submit(Intersection.of(on_st, to_st, boro)) if to_st else None
+            yield boro, on_st, from_st, to_st, start, end
+    finally:
+        # Even on failure, so nothing waits on a batch that is never sent
+        engine.flush()
+
+def write_atomic(path, data):
+    # A fresh temp name per call, so concurrent writers never share one
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+# Precompressed variants written next to each artifact, in server preference order
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+def compress(data, encoding):
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return brotli.compress(data, quality=11)
+
+LoadedArtifact = namedtuple("LoadedArtifact", "path etag variants")
+
+class MapStore:
+    """Versioned published artifacts behind an atomically replaced pointer file.
+
+    ``publish`` writes each artifact (plus gzip/brotli variants) to
+    ``<name>-<version><suffix>`` and then swaps ``current.json`` to point at the new version,
+    so readers only ever open complete files. The previous version stays on disk for
+    :meth:`rollback`. Other processes pick up a new pointer within
+    ``MAP_POINTER_POLL_SECONDS``.
+    """
+    SUFFIXES = {"map": ".html", "geojson": ".geojson"}
+
+    def __init__(self, directory=MAP_DIR, keep=MAP_VERSIONS_KEPT):
+        self.directory = directory
+        self.keep = keep
+        self.pointer_path = os.path.join(directory, "current.json")
+        self.lock = threading.Lock()
+        self.pointer = {}
+        self.pointer_mtime = None
+        self.checked = 0.0
+        self.loaded = {}
+
+    def _load_pointer(self):
+        try:
+            mtime = os.stat(self.pointer_path).st_mtime_ns
+            if mtime != self.pointer_mtime:
+                with open(self.pointer_path) as f:
+                    self.pointer = json.load(f)
+                self.pointer_mtime = mtime
+        except (OSError, ValueError):
+            pass
+        self.checked = time.monotonic()
+
+    def _write_pointer(self, pointer):
+        write_atomic(self.pointer_path, json.dumps(pointer).encode())
+        self.pointer = pointer
+        self.pointer_mtime = os.stat(self.pointer_path).st_mtime_ns
+
+    def current(self):
+        """The published version record (``version``, ``published_at``, ``files``) or ``None``."""
+        with self.lock:
+            if time.monotonic() - self.checked > MAP_POINTER_POLL_SECONDS:
+                self._load_pointer()
+            return self.pointer.get("current")
+
+    def path(self, artifact):
+        current = self.current()
+        name = current and current["files"].get(artifact)
+        return os.path.join(self.directory, name) if name else None
+
+    def load(self, artifact):
+        """Return the current version of ``artifact`` held in memory, or ``None``."""
+        path = self.path(artifact)
+        if not path:
+            return None
+        loaded = self.loaded.get(artifact)
+        if loaded and loaded.path == path:
+            return loaded
+        with open(path, "rb") as f:
+            variants = {"identity": f.read()}
+        for encoding, suffix in ENCODINGS.items():
+            try:
+                with open(path + suffix, "rb") as f:
+                    variants[encoding] = f.read()
+            except OSError:
+                pass
+        etag = hashlib.sha256(variants["identity"]).hexdigest()[:32]
+        loaded = self.loaded[artifact] = LoadedArtifact(path, etag, variants)
+        return loaded
+
+    def publish(self, artifacts):
+        """Atomically publish ``{artifact name: bytes}`` as a new version."""
+        os.makedirs(self.directory, exist_ok=True)
+        version = str(time.time_ns() // 1000000)
+        files = {}
+        for artifact, data in artifacts.items():
+            files[artifact] = f"{artifact}-{version}{self.SUFFIXES[artifact]}"
+            path = os.path.join(self.directory, files[artifact])
+            for encoding, suffix in ENCODINGS.items():
+                if encoding != "br" or brotli:
+                    compressed = compress(data, encoding)
+                    write_atomic(path + suffix, compressed)
+                    OUTPUT_BYTES.labels(artifact, encoding).inc(len(compressed))
+            write_atomic(path, data)
+            OUTPUT_BYTES.labels(artifact, "identity").inc(len(data))
+        with self.lock:
+            self._load_pointer()
+            now = time.time()
+            record = {"version": version, "published_at": now, "checked_at": now, "files": files}
+            self._write_pointer({"current": record, "previous": self.pointer.get("current")})
+        self._prune()
+        return record
+
+    def age(self):
+        """Seconds since the current version was last confirmed up to date, or ``None``."""
+        current = self.current()
+        return time.time() - current.get("checked_at", current["published_at"]) if current else None
+
+    def mark_checked(self):
+        """Record that the current version was confirmed up to date with the schedule."""
+        with self.lock:
+            self._load_pointer()
+            if self.pointer.get("current"):
+                current = dict(self.pointer["current"], checked_at=time.time())
+                self._write_pointer(dict(self.pointer, current=current))
+
+    def rollback(self):
+        """Swap the current and previous versions; returns the now-current record or ``None``."""
+        with self.lock:
+            self._load_pointer()
+            previous = self.pointer.get("previous")
+            if not previous:
+                return None
+            self._write_pointer({"current": previous, "previous": self.pointer.get("current")})
+            return previous
+
+    def _prune(self):
+        def version_of(name):
+            return name.split("-", 1)[1].split(".", 1)[0]
+        names = [n for n in os.listdir(self.directory) if n.split("-", 1)[0] in self.SUFFIXES and "-" in n]
+        versions = sorted({version_of(n) for n in names}, key=int)
+        keep = set(versions[-self.keep:])
+        keep.update(r["version"] for r in (self.pointer.get("current"), self.pointer.get("previous")) if r)
+        for name in names:
+            if version_of(name) not in keep and not name.endswith(".tmp"):
+                os.remove(os.path.join(self.directory, name))
+
+map_store = MapStore()
+
+PdfDownload = namedtuple("PdfDownload", "status content etag last_modified")
+
+def load_pdf_state():
+    try:
+        with open(PDF_STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_pdf_state(state):
+    tmp = PDF_STATE_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, PDF_STATE_FILE)
+
+def download_latest_pdf(state=None):
+    """Fetch the schedule, sending the validators saved in ``state`` as conditional headers.
+
+    Returns a :data:`PdfDownload` (``content`` is ``None`` on ``304 Not Modified``), or
+    ``None`` if the download failed.
+    """
+    headers = {}
+    if state and state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state and state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+    try:
+        r = requests.get(PDF_URL, stream=True, timeout=30, headers=headers)
+        if r.status_code == 304:
+            return PdfDownload(304, None, r.headers.get("ETag"), r.headers.get("Last-Modified"))
         if r.status_code == 200:
-            return io.BytesIO(r.content)
+            return PdfDownload(200, r.content, r.headers.get("ETag"), r.headers.get("Last-Modified"))
         else:
             print("Failed to download PDF. Status code:", r.status_code)
     except Exception as e:
         print("Exception during PDF download:", e)
     return None
 
-def extract_rows(pdf_filelike):
-    boro_tokens = ["Bronx", "Brooklyn", "Manhattan", "Queens", "STATEN"]
+def _parse_cache_path(sha256):
+    # Rows depend on the text backend as well as the PDF bytes
+    return os.path.join(PARSE_CACHE_DIR, f"{sha256}-{PDF_TEXT_BACKEND}.jsonl")
+
+def load_parsed_rows(sha256):
+    """Return an iterator over the cached ``(boro, on_st, from_st, to_st)`` rows, or ``None``."""
+    path = _parse_cache_path(sha256)
+    try:
+        f = open(path)
+    except OSError:
+        return None
+    os.utime(path)  # mark as recently used for eviction
+
+    def rows():
+        with f:
+            for line in f:
+                yield tuple(json.loads(line))
+    return rows()
+
+def save_parsed_rows(sha256, rows):
+    """Pass ``rows`` through while writing them to the parse cache.
+
+    The cache entry only appears once every row has been consumed.
+    """
+    os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+    path = _parse_cache_path(sha256)
+    count = 0
+    with open(path + ".tmp", "w") as f:
+        for row in rows:
+            f.write(json.dumps(row, separators=(",", ":")) + "\n")
+            count += 1
+            yield row
+    os.replace(path + ".tmp", path)
+    ROWS_PARSED.inc(count)
+    entries = sorted(
+        (os.path.join(PARSE_CACHE_DIR, name) for name in os.listdir(PARSE_CACHE_DIR) if name.endswith(".jsonl")),
+        key=os.path.getmtime,
+    )
+    for old in entries[:-PARSE_CACHE_MAX_ENTRIES]:
+        os.remove(old)
+
+def skip_generation(reason):
+    PIPELINE_SKIPS.labels(reason).inc()
+    map_store.mark_checked()
+    print(f"Schedule unchanged ({reason}), skipping map generation.")
+
+def _hash_pdf_value(h, value, seen):
+    """Feed a PDF object into ``h``: stream data, dicts by sorted key, lists in order."""
+    if isinstance(value, PDFObjRef):
+        if value.objid in seen:
+            h.update(f"@{value.objid}".encode())
+            return
+        seen.add(value.objid)
+    value = resolve1(value)
+    if isinstance(value, PDFStream):
+        _hash_pdf_value(h, value.attrs, seen)
+        h.update(value.get_data())
+    elif isinstance(value, dict):
+        for key in sorted(value):
+            h.update(f"/{key}".encode())
+            _hash_pdf_value(h, value[key], seen)
+    elif isinstance(value, list):
+        for item in value:
+            _hash_pdf_value(h, item, seen)
+    else:
+        h.update(repr(value).encode())
+
+def _hash_resources(h, resources, seen):
+    """Hash whatever in a resource dict can change the extracted text.
+
+    Fonts contribute their base font, encoding and ToUnicode map; Form XObjects their content
+    stream and, recursively, their own resources. Images contribute only their names.
+    """
+    resources = resolve1(resources) or {}
+    fonts = resolve1(resources.get("Font")) or {}
+    for name in sorted(fonts):
+        font = resolve1(fonts[name]) or {}
+        h.update(f"{name}={font.get('BaseFont')!r}".encode())
+        for key in ("Encoding", "ToUnicode"):
+            if key in font:
+                _hash_pdf_value(h, font[key], seen)
+    xobjects = resolve1(resources.get("XObject")) or {}
+    for name in sorted(xobjects):
+        ref = xobjects[name]
+        xobject = resolve1(ref)
+        if not isinstance(xobject, PDFStream) or xobject.get("Subtype") is None:
+            continue
+        h.update(f"{name}={xobject.get('Subtype')!r}".encode())
+        if getattr(xobject.get("Subtype"), "name", None) != "Form":
+            continue
+        objid = getattr(ref, "objid", None)
+        if objid in seen:
+            continue
+        if objid is not None:
+            seen.add(objid)
+        h.update(repr(resolve1(xobject.get("Matrix"))).encode())
+        h.update(xobject.get_data())
+        _hash_resources(h, xobject.get("Resources"), seen)
+
+def page_fingerprints(pdf_bytes):
+    """Hash each page's decoded content streams, media box and resources, in page order."""
+    document = PDFDocument(PDFParser(io.BytesIO(pdf_bytes)))
+    fingerprints = []
+    for page in PDFPage.create_pages(document):
+        h = hashlib.sha256(repr(page.mediabox).encode())
+        for stream in page.contents:
+            h.update(resolve1(stream).get_data())
+        _hash_resources(h, page.resources, set())
+        fingerprints.append(h.hexdigest())
+    return fingerprints
+
+def load_page_cache():
+    try:
+        with open(PAGE_CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_page_cache(cache):
+    entries = list(cache.items())[-PAGE_CACHE_MAX_ENTRIES:]
+    tmp = PAGE_CACHE_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(dict(entries), f)
+    os.replace(tmp, PAGE_CACHE_FILE)
+
+def iter_page_texts(pdf_bytes, backend=PDF_TEXT_BACKEND, workers=PDF_WORKERS, use_cache=True):
+    """Yield the text of every page in order (column rows for well-formed pages with "layout").
+
+    Pages whose fingerprint is in the page cache are reused; the rest are extracted in chunks
+    of at most ``PDF_PAGE_CHUNK``, spread over up to ``workers`` processes when there are
+    enough of them. Chunks are yielded as they finish, so later stages can start on the first
+    pages straight away. The page cache is loaded whole and newly extracted texts are kept
+    until the last page, when the cache is saved once.
+    """
+    if backend not in available_pdf_text_backends():
+        print(f"PDF text backend {backend!r} is not available, using pdfplumber.")
+        backend = "pdfplumber"
+    extract = PDF_TEXT_BACKENDS[backend]
+    keys = [f"{backend}:{fp}" for fp in page_fingerprints(pdf_bytes)]
+    cache = load_page_cache() if use_cache else {}
+    missing = [i for i, key in enumerate(keys) if key not in cache]
+    parallel = workers > 1 and len(missing) >= PDF_PARALLEL_MIN_PAGES
+    # Even chunks of at most PDF_PAGE_CHUNK pages, and at least one per worker
+    count = -(-len(missing) // PDF_PAGE_CHUNK)
+    if parallel:
+        count = max(count, min(workers, len(missing)))
+    chunks = [missing[i * len(missing) // count:(i + 1) * len(missing) // count] for i in range(count)]
+    pool = None
+    if not parallel or len(chunks) < 2:
+        extracted = (extract(pdf_bytes, chunk) for chunk in chunks)
+    else:
+        # Forking this process would copy the pipeline's other threads and any locks they
+        # hold; forkserver workers start clean and import only pdf_text
+        context = None
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["pdf_text"])
+        pool = ProcessPoolExecutor(
+            max_workers=min(workers, len(chunks)), mp_context=context,
+            initializer=pdf_text.init_extract_worker, initargs=(pdf_bytes, backend),
+        )
+        extracted = pool.map(pdf_text.extract_chunk, chunks)
+    fresh = {}
+    try:
+        texts = (text for chunk in extracted for text in chunk)
+        missing = set(missing)
+        for i, key in enumerate(keys):
+            if i in missing:
+                fresh[key] = next(texts)
+            yield fresh[key] if key in fresh else cache[key]
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    if use_cache:
+        print(f"Pages: {len(keys) - len(missing)} reused, {len(missing)} reparsed.")
+        # Re-insert this PDF's pages last so they survive trimming
+        for key in keys:
+            cache[key] = fresh[key] if key in fresh else cache.pop(key)
+        save_page_cache(cache)
+
+def extract_page_texts(pdf_bytes, backend=PDF_TEXT_BACKEND, workers=PDF_WORKERS, use_cache=True):
+    return list(iter_page_texts(pdf_bytes, backend, workers, use_cache))
+
+BORO_TOKENS = ["Bronx", "Brooklyn", "Manhattan", "Queens", "STATEN"]
+
+def _text_page_rows(text, boro):
+    rows = []
+    for raw in text.splitlines():
+        ln = raw.strip()
+        if not ln or "Schedule for" in ln or ln.startswith("Borough"):
+            continue
+        if any(ln.startswith(b) for b in BORO_TOKENS):
+            parts = ln.split(maxsplit=2)
+            boro = "Staten Island" if "STATEN" in parts[0] else parts[0]
+            ln = parts[2] if len(parts) > 2 else ""
+        ln = ln.lstrip("SIP ").lstrip("IFA ")
+        if not ln.endswith("Concrete"):
+            continue
+        rows.append((boro, ln[:-8].strip()))
+    return rows, boro
+
+def _column_page_rows(lines, boro):
+    rows = []
+    for prefix, on_st, from_st, to_st in lines:
+        first = prefix.split(maxsplit=1)[0] if prefix else ""
+        if first == "Borough":
+            continue
+        if any(first.startswith(b) for b in BORO_TOKENS):
+            boro = "Staten Island" if "STATEN" in first else first
+        if not to_st.endswith("Concrete"):
+            continue
+        on_words = on_st.split()
+        if on_words and on_words[0] in ("SIP", "IFA"):
+            on_words = on_words[1:]
+        rows.append((boro, " ".join(on_words), from_st, to_st[:-8].strip()))
+    return rows, boro
+
+def rows_from_page_texts(page_texts):
+    """Parse page texts in page order; the current borough carries across page boundaries."""
     rows, boro = [], None
-    with pdfplumber.open(pdf_filelike) as pdf:
-        for page in pdf.pages:
-            for raw in page.extract_text().splitlines():
-                ln = raw.strip()
-                if not ln or "Schedule for" in ln or ln.startswith("Borough"):
-                    continue
-                if any(ln.startswith(b) for b in boro_tokens):
-                    parts = ln.split(maxsplit=2)
-                    boro = "Staten Island" if "STATEN" in parts[0] else parts[0]
-                    ln = parts[2] if len(parts) > 2 else ""
-                ln = ln.lstrip("SIP ").lstrip("IFA ")
-                if not ln.endswith("Concrete"):
-                    continue
-                rows.append((boro, ln[:-8].strip()))
+    for text in page_texts:
+        page_rows, boro = _text_page_rows(text, boro)
+        rows.extend(page_rows)
     return rows
 
+def extract_rows(pdf_filelike):
+    return rows_from_page_texts(extract_page_texts(pdf_filelike.read()))
+
+def iter_rows(pages):
+    """Parse extracted pages in page order into ``(boro, on_st, from_st, to_st)`` rows.
+
+    Text pages go through the line filter and :func:`split_streets`; column pages from the
+    layout backend already have their streets separated. The borough carries across pages.
+    """
+    boro = None
+    for page in pages:
+        if isinstance(page, str):
+            page_rows, boro = _text_page_rows(page, boro)
+            for b, block in page_rows:
+                yield (b, *split_streets(block))
+        else:
+            page_rows, boro = _column_page_rows(page, boro)
+            yield from page_rows
+
+# Words that end a street name, as matched by the original " ST| STREET| ...$" search
+STREET_SUFFIX_WORDS = frozenset({*STREET_SUFFIXES, *STREET_SUFFIXES.values(), "WAY"})
+STREET_SUFFIX_WORD = re.compile("|".join(sorted(STREET_SUFFIX_WORDS)), re.I)
+COLUMN_GAP = re.compile(r"\s{2,}")
+
+def is_street_suffix(word):
+    if word.isascii():
+        return word.upper() in STREET_SUFFIX_WORDS
+    # Unicode case rules differ between str.upper and re.I ("ﬆ".upper() is "ST", but re.I
+    # does not match it; a long s does match), so non-ASCII words go through the regex
+    return STREET_SUFFIX_WORD.fullmatch(word) is not None
+
 def split_streets(block):
-    street_types = r"( ST| STREET| AVE| AVENUE| RD| ROAD| BLVD| BOULEVARD| PKWY| PARKWAY| PL| PLACE| DR| DRIVE| CT| COURT| HWY| HIGHWAY| WAY| LANE| LN| EXPWY| EXPRESSWAY)$"
-    tokens = re.split(r"\s{2,}", block)
-    tokens = [t.strip() for t in tokens if t.strip()]
+    tokens = [t.strip() for t in COLUMN_GAP.split(block) if t.strip()]
     if len(tokens) == 3:
         return tokens
-    streets, buf = [], []
-    for word in block.split():
-        buf.append(word)
-        joined = " ".join(buf)
-        if re.search(street_types, joined, re.I):
-            streets.append(joined)
-            buf = []
-        if len(streets) == 3:
-            break
-    if buf and len(streets) < 3:
-        streets.append(" ".join(buf))
+    # A street ends at a suffix word that follows at least one other word
+    words = block.split()
+    streets, start = [], 0
+    for i, word in enumerate(words):
+        if i > start and is_street_suffix(word):
+            streets.append(" ".join(words[start:i + 1]))
+            start = i + 1
+            if len(streets) == 3:
+                break
+    if start < len(words) and len(streets) < 3:
+        streets.append(" ".join(words[start:]))
     while len(streets) < 3:
         streets.append("")
-    return streets[:3]
+    return streets
+
+def locate_segments(segments):
+    """Wait for each segment's points, in row order, dropping those without a start.
+
+    Returns a list of ``(boro, on_st, from_st, to_st, start_point, end_point)`` tuples, one
+    per placed row, since the renderers need them all; ``end_point`` is ``None`` when the To
+    street is missing or could not be geocoded.
+    """
+    placed = []
+    for boro, on_st, from_st, to_st, start, end in segments:
+        start_point = start.result()
+        if start_point:
+            placed.append((boro, on_st, from_st, to_st, start_point, end.result() if end else None))
+    return placed
+
+def segments_geojson(placed):
+    """Encode placed segments as a compact GeoJSON FeatureCollection.
+
+    Each block becomes a ``segment`` LineString plus ``start``/``end`` Points, or a single
+    ``point`` when it has no end. Borough colours are sent once as a foreign member.
+    """
+    def lonlat(point):
+        return [round(point[1], 6), round(point[0], 6)]
+
+    def feature(kind, geometry_type, coordinates, boro, on_st, from_st, to_st):
+        return {
+            "type": "Feature",
+            "geometry": {"type": geometry_type, "coordinates": coordinates},
+            "properties": {"kind": kind, "boro": boro, "on": on_st, "from": from_st, "to": to_st},
+        }
+
+    features = []
+    for boro, on_st, from_st, to_st, start, end in placed:
+        streets = (boro, on_st, from_st, to_st)
+        if end:
+            features.append(feature("segment", "LineString", [lonlat(start), lonlat(end)], *streets))
+            features.append(feature("start", "Point", lonlat(start), *streets))
+            features.append(feature("end", "Point", lonlat(end), *streets))
+        else:
+            features.append(feature("point", "Point", lonlat(start), *streets))
+    collection = {"type": "FeatureCollection", "colours": dict(BOROUGH_COLOURS), "features": features}
+    return json.dumps(collection, separators=(",", ":")).encode("utf-8")
+
+def render_folium(placed):
+    m = folium.Map(location=NYC_CENTRE, zoom_start=11, tiles="CartoDB positron", prefer_canvas=True)
+    # One toggleable layer per borough; endpoints are clustered inside it
+    groups, clusters = {}, {}
+    for boro in sorted({p[0] or "Unknown" for p in placed}):
+        groups[boro] = folium.FeatureGroup(name=boro).add_to(m)
+        clusters[boro] = MarkerCluster(options={"disableClusteringAtZoom": 15}).add_to(groups[boro])
+    for boro, on_st, from_st, to_st, start_location, end_location in placed:
+        group, cluster = groups[boro or "Unknown"], clusters[boro or "Unknown"]
+        # Draw line if both endpoints exist, otherwise just mark the start
+        if end_location:
+            folium.PolyLine(
+                locations=[
+                    list(start_location),
+                    list(end_location)
+                ],
+                color=BOROUGH_COLOURS[boro],
+                weight=6,
+                opacity=0.35,
+                popup=f"{boro}: {on_st} from {from_st} to {to_st}"
+            ).add_to(group)
+            folium.CircleMarker(
+                location=list(start_location),
+                radius=4,
+                color=BOROUGH_COLOURS[boro],
+                fill=True,
+                fill_color=BOROUGH_COLOURS[boro],
+                fill_opacity=0.9,
+                popup=f"START: {on_st} & {from_st}"
+            ).add_to(cluster)
+            folium.CircleMarker(
+                location=list(end_location),
+                radius=4,
+                color=BOROUGH_COLOURS[boro],
+                fill=True,
+                fill_color=BOROUGH_COLOURS[boro],
+                fill_opacity=0.9,
+                popup=f"END: {on_st} & {to_st}"
+            ).add_to(cluster)
+        else:
+            folium.Marker(
+                location=list(start_location),
+                popup=f"{boro}: {on_st} at {from_st} (no end point found)",
+                icon=folium.Icon(color=BOROUGH_COLOURS[boro])
+            ).add_to(cluster)
+    folium.LayerControl(collapsed=False).add_to(m)
+    return m.get_root().render().encode("utf-8")
+
+MAP_TEMPLATE = string.Template("""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css">
+<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/Leaflet.awesome-markers/2.0.2/leaflet.awesome-markers.css">
+<link rel="stylesheet" href="https://netdna.bootstrapcdn.com/bootstrap/3.0.0/css/bootstrap-glyphicons.css">
+<link rel="stylesheet" href="https://unpkg.com/leaflet.markercluster@1.5.3/dist/MarkerCluster.css">
+<link rel="stylesheet" href="https://unpkg.com/leaflet.markercluster@1.5.3/dist/MarkerCluster.Default.css">
+<script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"></script>
+<script src="https://unpkg.com/leaflet.markercluster@1.5.3/dist/leaflet.markercluster.js"></script>
+<script src="https://cdnjs.cloudflare.com/ajax/libs/Leaflet.awesome-markers/2.0.2/leaflet.awesome-markers.js"></script>
+<style>html, body, #map { width: 100%; height: 100%; margin: 0; padding: 0; }</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+$script
+</script>
+<script>
+drawSchedule(createScheduleMap("map"), $data);
+</script>
+</body>
+</html>
+""")
+
+with open(os.path.join(app.root_path, "static", "map.js")) as f:
+    MAP_SCRIPT = f.read()
+
+def render_template_map(geojson):
+    """Render the map page from one template with the GeoJSON embedded as a single literal.
+
+    Draws the same features as :func:`render_folium` (via ``static/map.js``) without
+    building a folium object per feature.
+    """
+    data = geojson.decode("utf-8").replace("</", "<\\/")
+    return MAP_TEMPLATE.substitute(script=MAP_SCRIPT, data=data).encode("utf-8")
+
+class SegmentIndex:
+    """Uniform-grid spatial index over the blocks of one published GeoJSON artifact.
+
+    Each block (a ``segment`` LineString, or a ``point`` for blocks without an end) is
+    serialized once at build time, so a query only walks grid cells, filters bounding
+    boxes and joins pre-encoded bytes. Instances are immutable; a new one is swapped in
+    after each publish.
+    """
+    CELL_DEGREES = 0.01
+
+    def __init__(self, source, geojson):
+        self.source = source
+        self.features = []  # (min_lon, min_lat, max_lon, max_lat, boro, encoded feature)
+        self.cells = defaultdict(list)
+        for feature in json.loads(geojson)["features"]:
+            if feature["properties"]["kind"] not in ("segment", "point"):
+                continue
+            coords = feature["geometry"]["coordinates"]
+            coords = coords if feature["geometry"]["type"] == "LineString" else [coords]
+            lons, lats = [c[0] for c in coords], [c[1] for c in coords]
+            bbox = (min(lons), min(lats), max(lons), max(lats))
+            boro = (feature["properties"]["boro"] or "").lower()
+            i = len(self.features)
+            self.features.append((*bbox, boro, json.dumps(feature, separators=(",", ":")).encode("utf-8")))
+            for cell in self._cells(bbox):
+                self.cells[cell].append(i)
+
+    def _cells(self, bbox):
+        min_lon, min_lat, max_lon, max_lat = bbox
+        size = self.CELL_DEGREES
+        for x in range(int(min_lon // size), int(max_lon // size) + 1):
+            for y in range(int(min_lat // size), int(max_lat // size) + 1):
+                yield (x, y)
+
+    def query(self, bbox=None, boro=None):
+        """Yield encoded features intersecting ``bbox`` (and in ``boro``), in schedule order."""
+        boro = boro.lower() if boro else None
+        if bbox is None:
+            candidates = range(len(self.features))
+        else:
+            # Scanning every cell of a huge box would cost more than scanning every feature
+            width, height = (bbox[2] - bbox[0]) / self.CELL_DEGREES, (bbox[3] - bbox[1]) / self.CELL_DEGREES
+            if (width + 1) * (height + 1) > len(self.cells):
+                candidates = range(len(self.features))
+            else:
+                candidates = sorted({i for cell in self._cells(bbox) for i in self.cells.get(cell, ())})
+        for i in candidates:
+            min_lon, min_lat, max_lon, max_lat, feature_boro, encoded = self.features[i]
+            if boro and feature_boro != boro:
+                continue
+            if bbox and (max_lon < bbox[0] or min_lon > bbox[2] or max_lat < bbox[1] or min_lat > bbox[3]):
+                continue
+            yield encoded
+
+segment_index = None
+segment_index_lock = threading.Lock()
+
+def current_segment_index():
+    """The index for the currently published GeoJSON, rebuilt and swapped in when it changes."""
+    global segment_index
+    loaded = map_store.load("geojson")
+    if not loaded:
+        return None
+    index = segment_index
+    if index is None or index.source != loaded.path:
+        with segment_index_lock:
+            if segment_index is None or segment_index.source != loaded.path:
+                segment_index = SegmentIndex(loaded.path, loaded.variants["identity"])
+            index = segment_index
+    return index
+
+# Queues between the running pipeline's stages, by stage name, for /status
+pipeline_queues = {}
+
+class _StageFailed:
+    def __init__(self, error):
+        self.error = error
+
+_STAGE_DONE = object()
+
+def threaded(items, stage, maxsize=PIPELINE_QUEUE_SIZE):
+    """Iterate ``items`` on a thread of its own and yield them through a bounded queue.
+
+    The producer runs at most ``maxsize`` items ahead of the consumer. Its exceptions are
+    re-raised in the consumer; if the consumer stops early, the producer is abandoned at
+    its next item. The producer's running time is recorded under ``stage``.
+    """
+    q = queue.Queue(maxsize)
+    stopped = threading.Event()
+    depth = PIPELINE_QUEUE_DEPTH.labels(stage)
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                q.put(item, timeout=0.5)
+            except queue.Full:
+                continue
+            depth.set(q.qsize())
+            return True
+        return False
+
+    def produce():
+        started = time.time()
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_STAGE_DONE)
+            STAGE_SECONDS.labels(stage).observe(time.time() - started)
+        except BaseException as e:
+            put(_StageFailed(e))
+        finally:
+            # Let an upstream stage (or process pool) wind down too
+            if hasattr(items, "close"):
+                items.close()
+
+    pipeline_queues[stage] = q
+    threading.Thread(target=produce, name=f"pipeline-{stage}", daemon=True).start()
+    try:
+        while True:
+            item = q.get()
+            depth.set(q.qsize())
+            if item is _STAGE_DONE:
+                return
+            if isinstance(item, _StageFailed):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        depth.set(0)
+        if pipeline_queues.get(stage) is q:
+            del pipeline_queues[stage]
 
 def generate_and_save_map():
     try:
         print("Generating new map...")
-        pdf_filelike = download_latest_pdf()
-        if not pdf_filelike:
+        coordinator.set_stage("download")
+        # Only trust the saved validators while the map they produced still exists, is
+        # complete and was built with the current settings (a new renderer needs artifacts
+        # the old one skipped)
+        config = {"renderer": MAP_RENDERER, "text_backend": PDF_TEXT_BACKEND}
+        state = load_pdf_state() if map_store.current() else {}
+        if state.get("config") != config or state.get("complete") is False:
+            state = {}
+        download = download_latest_pdf(state)
+        if not download:
             print("No PDF downloaded, skipping map generation.")
             return
+        if download.status == 304:
+            skip_generation("not_modified")
+            return
+        sha256 = hashlib.sha256(download.content).hexdigest()
+        new_state = {
+            "etag": download.etag, "last_modified": download.last_modified, "sha256": sha256,
+            "config": config,
+        }
+        if sha256 == state.get("sha256"):
+            save_pdf_state(new_state)
+            skip_generation("same_content")
+            return
 
-        rows = extract_rows(pdf_filelike)
-        borough_colours = defaultdict(
-            lambda: "gray",
-            {
-                "Bronx": "red",
-                "Brooklyn": "blue",
-                "Manhattan": "green",
-                "Queens": "orange",
-                "Staten Island": "purple"
-            }
-        )
-        m = folium.Map(location=NYC_CENTRE, zoom_start=11, tiles="CartoDB positron")
-        geocoder = ArcGIS(timeout=10)
-        for idx, (boro, block) in enumerate(rows):
-            on_st, from_st, to_st = split_streets(block)
-            if not (on_st and from_st):
-                continue
-            # Geocode start (On Street & From Street)
-            start_addr = f"{on_st} & {from_st}, {boro}, NY"
-            start_location = None
-            tries = 0
-            while start_location is None and tries < 3:
-                try:
-                    start_location = geocoder.geocode(start_addr)
-                except Exception:
-                    time.sleep(1)
-                tries += 1
-            if not start_location:
-                continue
-            # Geocode end (On Street & To Street), if To Street exists
-            end_location = None
-            if to_st:
-                end_addr = f"{on_st} & {to_st}, {boro}, NY"
-                tries = 0
-                while end_location is None and tries < 3:
-                    try:
-                        end_location = geocoder.geocode(end_addr)
-                    except Exception:
-                        time.sleep(1)
-                    tries += 1
-            # Draw line if both endpoints exist, otherwise just mark the start
-            if end_location:
-                folium.PolyLine(
-                    locations=[
-                        [start_location.latitude, start_location.longitude],
-                        [end_location.latitude, end_location.longitude]
-                    ],
-                    color=borough_colours[boro],
-                    weight=6,
-                    opacity=0.35,
-                    popup=f"{boro}: {on_st} from {from_st} to {to_st}"
-                ).add_to(m)
-                folium.CircleMarker(
-                    location=[start_location.latitude, start_location.longitude],
-                    radius=4,
-                    color=borough_colours[boro],
-                    fill=True,
-                    fill_color=borough_colours[boro],
-                    fill_opacity=0.9,
-                    popup=f"START: {on_st} & {from_st}"
-                ).add_to(m)
-                folium.CircleMarker(
-                    location=[end_location.latitude, end_location.longitude],
-                    radius=4,
-                    color=borough_colours[boro],
-                    fill=True,
-                    fill_color=borough_colours[boro],
-                    fill_opacity=0.9,
-                    popup=f"END: {on_st} & {to_st}"
-                ).add_to(m)
-            else:
-                folium.Marker(
-                    location=[start_location.latitude, start_location.longitude],
-                    popup=f"{boro}: {on_st} at {from_st} (no end point found)",
-                    icon=folium.Icon(color=borough_colours[boro])
-                ).add_to(m)
-        # Save the map as an HTML file
-        m.save(MAP_FILE)
+        # Pages, rows, segments and geocodes stream through bounded queues, so geocoding the
+        # first pages overlaps with extracting the rest. Memory still grows with the schedule:
+        # the engine keeps a future per unique intersection, the placed segments are collected
+        # for the renderers, and each artifact is built and compressed whole.
+        coordinator.set_stage("stream")
+        geocode_cache.reset_stats()
+        split_rows = load_parsed_rows(sha256)
+        if split_rows is None:
+            pages = threaded(iter_page_texts(download.content), "extract_rows")
+            split_rows = save_parsed_rows(sha256, iter_rows(pages))
+        else:
+            print(f"Parse cache hit for {sha256[:12]}.")
+        # The total grows as planning discovers unique intersections
+        engine = GeocodeEngine(make_geocoder_chain(), progress=coordinator.advance, planned=coordinator.expect)
+        with engine:
+            segments = plan_segments(threaded(split_rows, "split_streets"), engine)
+            placed = locate_segments(threaded(segments, "plan"))
+        coordinator.set_stage("render")
+        artifacts = {"geojson": segments_geojson(placed)}
+        if MAP_RENDERER == "folium":
+            artifacts["map"] = render_folium(placed)
+        elif MAP_RENDERER == "template":
+            artifacts["map"] = render_template_map(artifacts["geojson"])
+        # Publish the map atomically so readers never see a partial file
+        coordinator.set_stage("publish")
+        map_store.publish(artifacts)
+        current_segment_index()
+        # A map missing segments because lookups failed (say, the breaker tripped during an
+        # outage) must not let the next run skip an unchanged schedule
+        new_state["complete"] = not engine.failed
+        save_pdf_state(new_state)
         print("Map saved!")
+        if engine.failed:
+            print("Some lookups failed; the next run rebuilds the map even if the schedule is unchanged.")
+        print(f"Geocode cache: {geocode_cache.hits} hits, {geocode_cache.misses} misses")
     except Exception as e:
         print("Error generating map:")
         traceback.print_exc()
+    finally:
+        geocode_cache.flush()
+
+class LeaderLock:
+    """Pipeline leadership across worker processes, held as an exclusive ``flock``.
+
+    Only the process holding the lock downloads, geocodes and publishes; the others serve
+    what it publishes. The kernel drops the lock when the leader exits or dies, and the
+    next follower to poll takes over.
+    """
+
+    def __init__(self, path=LEADER_LOCK_FILE):
+        self.path = path
+        self.fd = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    @property
+    def held(self):
+        return self.fd is not None and self.pid == os.getpid()
+
+    def acquire(self):
+        """Try to become leader without blocking; returns whether this process is leader."""
+        with self.lock:
+            if self.held:
+                return True
+            # A lock inherited over fork belongs to the parent, not to us
+            self.fd = None
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            os.ftruncate(fd, 0)
+            os.write(fd, str(os.getpid()).encode())
+            self.fd, self.pid = fd, os.getpid()
+            print(f"Process {os.getpid()} is now the map pipeline leader.")
+            return True
+
+leader = LeaderLock()
+
+class JobCoordinator:
+    """Keeps at most one pipeline run in flight and coalesces triggers that arrive meanwhile.
+
+    Any number of triggers during a run collapse into a single follow-up run. The current
+    stage and progress are mirrored to ``PIPELINE_STATUS_FILE`` (at most once a second while
+    progress ticks) so every worker can report them.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.lock = threading.Lock()
+        self.running = False
+        self.pending = False
+        self.coalesced = 0
+        self.reason = None
+        self.stage = "idle"
+        self.done = 0
+        self.total = 0
+        self.run_started_at = None
+        self.stage_started_at = None
+        self.last_finished_at = None
+        self.status_written = 0.0
+        self.status_lock = threading.Lock()
+
+    def trigger(self, reason):
+        """Run the job in this thread, or queue one follow-up run if a run is in flight."""
+        with self.lock:
+            if self.running:
+                self.coalesced += self.pending
+                self.pending = True
+                print(f"Map run already in progress, queued a follow-up ({reason}).")
+                return False
+            self.running = True
+        try:
+            while True:
+                self.reason = reason
+                self.run_started_at = time.time()
+                self.job()
+                with self.lock:
+                    if not self.pending:
+                        break
+                    self.pending = False
+                    reason = "coalesced"
+        finally:
+            with self.lock:
+                self.running = False
+                self.last_finished_at = time.time()
+            self.set_stage("idle")
+        return True
+
+    def trigger_async(self, reason):
+        threading.Thread(target=self.trigger, args=(reason,), name=f"map-{reason}", daemon=True).start()
+
+    def set_stage(self, stage, total=0):
+        """Enter ``stage``, recording how long the previous stage took."""
+        now = time.time()
+        if self.stage != "idle":
+            STAGE_SECONDS.labels(self.stage).observe(now - self.stage_started_at)
+        self.stage, self.done, self.total = stage, 0, total
+        self.stage_started_at = now
+        self._write_status(force=True)
+
+    def advance(self, n=1):
+        with self.lock:
+            self.done += n
+        self._write_status()
+
+    def expect(self, n=1):
+        """Add ``n`` to the current stage's total, for stages that discover work as they go."""
+        with self.lock:
+            self.total += n
+        self._write_status()
+
+    def snapshot(self):
+        return {
+            "running": self.running, "pending": self.pending, "coalesced": self.coalesced,
+            "reason": self.reason, "stage": self.stage, "done": self.done, "total": self.total,
+            "run_started_at": self.run_started_at, "stage_started_at": self.stage_started_at,
+            "last_finished_at": self.last_finished_at, "pid": os.getpid(),
+            "queues": {stage: q.qsize() for stage, q in list(pipeline_queues.items())},
+        }
+
+    def _write_status(self, force=False):
+        # Pool threads all report progress; one write at a time, at most once a second
+        with self.status_lock:
+            now = time.monotonic()
+            if not force and now - self.status_written < 1:
+                return
+            self.status_written = now
+            try:
+                write_atomic(PIPELINE_STATUS_FILE, json.dumps(self.snapshot()).encode())
+            except OSError as e:
+                print(f"Could not write {PIPELINE_STATUS_FILE}: {e}")
+
+coordinator = JobCoordinator(generate_and_save_map)
 
 # Schedule the job to run every hour
-@scheduler.task('interval', id='generate_map_job', hours=1, misfire_grace_time=900)
+@scheduler.task('interval', id='generate_map_job', hours=1, misfire_grace_time=900, coalesce=True)
 def scheduled_map_job():
-    generate_and_save_map()
+    if leader.acquire():
+        coordinator.trigger("scheduled")
 
-# Also generate the map at startup
-generate_and_save_map()
+# Followers keep polling for leadership so a dead leader is replaced promptly; the leader
+# also picks up refresh requests left by other workers
+@scheduler.task('interval', id='leader_election_job', seconds=LEADER_POLL_SECONDS)
+def leader_election_job():
+    if not leader.held and leader.acquire():
+        age = map_store.age()
+        if age is None or age >= MAP_FRESH_SECONDS:
+            coordinator.trigger_async("failover")
+    if leader.held and os.path.exists(REFRESH_REQUEST_FILE):
+        os.remove(REFRESH_REQUEST_FILE)
+        coordinator.trigger_async("manual")
+
+def artifact_response(artifact, mimetype):
+    """Serve an in-memory artifact with content negotiation and ETag revalidation."""
+    loaded = map_store.load(artifact)
+    if not loaded:
+        return None
+    offered = [e for e in ENCODINGS if e in loaded.variants]
+    encoding = request.accept_encodings.best_match(offered, default="identity")
+    etag = loaded.etag if encoding == "identity" else f"{loaded.etag}-{encoding}"
+    headers = {"ETag": f'"{etag}"', "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(loaded.variants[encoding], mimetype=mimetype, headers=headers)
 
 @app.route('/')
 def serve_map():
-    if os.path.exists(MAP_FILE):
-        return send_file(MAP_FILE)
+    if MAP_RENDERER == "leaflet":
+        return app.send_static_file("index.html")
+    response = artifact_response("map", "text/html")
+    if response:
+        return response
+    else:
+        return ('<meta http-equiv="refresh" content="30">'
+                "Map is not ready yet. Please check back soon.")
+
+@app.route('/api/segments.geojson')
+def segments_geojson_route():
+    response = artifact_response("geojson", "application/geo+json")
+    if response:
+        return response
+    return jsonify({"error": "Map data is not ready yet."}), 503
+
+@app.route('/api/segments')
+def query_segments():
+    bbox = request.args.get("bbox")
+    if bbox:
+        try:
+            bbox = tuple(float(v) for v in bbox.split(","))
+        except ValueError:
+            bbox = ()
+        # NaN would slip past the ordering checks and only fail mid-stream
+        if (len(bbox) != 4 or not all(math.isfinite(v) for v in bbox)
+                or bbox[0] > bbox[2] or bbox[1] > bbox[3]):
+            return jsonify({"error": "bbox must be min_lon,min_lat,max_lon,max_lat"}), 400
+    index = current_segment_index()
+    if index is None:
+        return jsonify({"error": "Map data is not ready yet."}), 503
+    matches = index.query(bbox or None, request.args.get("boro"))
+
+    def stream():
+        yield b'{"type":"FeatureCollection","features":['
+        for i, encoded in enumerate(matches):
+            yield b"," + encoded if i else encoded
+        yield b"]}"
+
+    return Response(stream(), mimetype="application/geo+json")
+
+@app.route('/ready')
+def ready():
+    current = map_store.current()
+    age = map_store.age()
+    fresh = age is not None and age < MAP_FRESH_SECONDS
+    body = {"ready": fresh, "version": current and current["version"], "age_seconds": age,
+            "leader": leader.held}
+    return jsonify(body), 200 if fresh else 503
+
+@app.route('/refresh', methods=['POST'])
+def refresh():
+    if leader.held:
+        coordinator.trigger_async("manual")
+    else:
+        # The leader picks this up within LEADER_POLL_SECONDS
+        write_atomic(REFRESH_REQUEST_FILE, b"")
+    return jsonify({"queued": True, "leader": leader.held}), 202
+
+@app.route('/status')
+def status():
+    if leader.held:
+        return jsonify(coordinator.snapshot())
+    try:
+        with open(PIPELINE_STATUS_FILE) as f:
+            return jsonify(json.load(f))
+    except (OSError, ValueError):
+        return jsonify({"stage": "unknown"})
+
+@app.route('/metrics')
+def metrics():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = prom.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
     else:
-        return "Map is not ready yet. Please check back soon."
+        registry = prom.REGISTRY
+    return Response(prom.generate_latest(registry), mimetype=prom.CONTENT_TYPE_LATEST)
+
+@app.cli.command("compare-pdf-backends")
+@click.argument("paths", nargs=-1, required=True)
+def compare_pdf_backends(paths):
+    """Check that every PDF text backend yields the same rows on saved schedules, and time them."""
+    # "layout" returns column cells rather than text, so it is not comparable here
+    backends = [name for name in available_pdf_text_backends() if name != "layout"]
+    totals = Counter()
+    mismatches = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            pdf_bytes = f.read()
+        results = {}
+        for name in backends:
+            start = time.perf_counter()
+            texts = extract_page_texts(pdf_bytes, backend=name, workers=1, use_cache=False)
+            results[name] = rows_from_page_texts(texts)
+            totals[name] += time.perf_counter() - start
+        reference = results[backends[0]]
+        for name in backends[1:]:
+            if results[name] != reference:
+                mismatches += 1
+                diff = next((i for i, (a, b) in enumerate(zip(reference, results[name])) if a != b),
+                            min(len(reference), len(results[name])))
+                print(f"{path}: {name} differs from {backends[0]} at row {diff} "
+                      f"({len(results[name])} vs {len(reference)} rows)")
+        print(f"{path}: {len(reference)} rows")
+    for name in backends:
+        print(f"{name}: {totals[name]:.3f}s total, {totals[backends[0]] / totals[name]:.2f}x vs {backends[0]}")
+    if mismatches:
+        raise SystemExit(1)
+
+@app.cli.command("rollback-map")
+def rollback_map():
+    """Point the served map back at the previously published version."""
+    record = map_store.rollback()
+    print(f"Now serving version {record['version']}." if record else "No previous version to roll back to.")
+
+@app.cli.command("bench-render")
+@click.option("--segments", default=2000, help="Number of synthetic schedule blocks.")
+def bench_render(segments):
+    """Compare render time and output size of the folium and template renderers."""
+    rng = random.Random(42)
+    placed = []
+    for i in range(segments):
+        boro = rng.choice(list(BOROUGH_COLOURS))
+        start = (40.55 + rng.random() * 0.35, -74.15 + rng.random() * 0.4)
+        end = (start[0] + 0.002, start[1] + 0.002) if rng.random() < 0.8 else None
+        placed.append((boro, f"{i} AVENUE", f"{i} STREET", f"{i + 1} STREET", start, end))
+    renderers = {
+        "folium": lambda: render_folium(placed),
+        "template": lambda: render_template_map(segments_geojson(placed)),
+    }
+    for name, render in renderers.items():
+        start = time.perf_counter()
+        html = render()
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {elapsed:.3f}s, {len(html) / 1e6:.2f} MB, "
+              f"{len(gzip.compress(html)) / 1e6:.2f} MB gzipped")
+
+@app.cli.command("bench-split")
+@click.option("--blocks", default=200000, help="Number of synthetic schedule blocks.")
+def bench_split(blocks):
+    """Time split_streets against the original per-word regex search, checking equal output."""
+    def split_streets_regex(block):
+        street_types = r"( ST| STREET| AVE| AVENUE| RD| ROAD| BLVD| BOULEVARD| PKWY| PARKWAY| PL| PLACE| DR| DRIVE| CT| COURT| HWY| HIGHWAY| WAY| LANE| LN| EXPWY| EXPRESSWAY)$"
+        tokens = re.split(r"\s{2,}", block)
+        tokens = [t.strip() for t in tokens if t.strip()]
+        if len(tokens) == 3:
+            return tokens
+        streets, buf = [], []
+        for word in block.split():
+            buf.append(word)
+            joined = " ".join(buf)
+            if re.search(street_types, joined, re.I):
+                streets.append(joined)
+                buf = []
+            if len(streets) == 3:
+                break
+        if buf and len(streets) < 3:
+            streets.append(" ".join(buf))
+        while len(streets) < 3:
+            streets.append("")
+        return streets[:3]
+
+    rng = random.Random(42)
+    names = ["5", "EAST 14", "ST NICHOLAS", "MAIN", "BROADWAY", "OCEAN", "FLATBUSH", "NORTHERN", "W 4", "PARK"]
+    suffixes = ["ST", "STREET", "Ave", "AVENUE", "RD", "BLVD", "PKWY", "PL", "DR", "CT", "HWY", "WAY", "LANE", ""]
+    corpus = []
+    for _ in range(blocks):
+        streets = [f"{rng.choice(names)} {rng.choice(suffixes)}".strip() for _ in range(rng.randint(1, 4))]
+        corpus.append(rng.choice([" ", "  ", " "]).join(streets))
+    timings = {}
+    for name, split in (("regex", split_streets_regex), ("split_streets", split_streets)):
+        start = time.perf_counter()
+        results = [split(block) for block in corpus]
+        timings[name] = time.perf_counter() - start
+        if name == "regex":
+            expected = results
+    mismatches = sum(a != b for a, b in zip(expected, results))
+    print(f"{blocks} blocks: regex {timings['regex']:.3f}s, split_streets {timings['split_streets']:.3f}s "
+          f"({timings['regex'] / timings['split_streets']:.1f}x), {mismatches} mismatches")
+    if mismatches:
+        raise SystemExit(1)
+
+def should_start_pipeline():
+    """Whether importing the app should start the scheduler and the startup run.
+
+    Not for this app's own CLI commands (``flask bench-split`` etc.), nor with
+    ``PIPELINE_AUTOSTART=0`` (tests and scripts that only want the functions).
+    """
+    if os.environ.get("PIPELINE_AUTOSTART", "1") == "0":
+        return False
+    # Re-imported as the main module inside a spawned or forkserver worker
+    if __name__ == "__mp_main__":
+        return False
+    return not set(sys.argv[1:]) & set(app.cli.commands)
+
+# Also generate the map at startup, in the background so the app can serve the last
+# published map (or a placeholder) straight away
+if should_start_pipeline():
+    scheduler.start()
+    if leader.acquire():
+        coordinator.trigger_async("startup")
 
 if __name__ == '__main__':
     app.run(debug=True)
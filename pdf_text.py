@@ -0,0 +1,84 @@
+"""Text extraction backends for the schedule PDF.
+
+This module holds no app state and starts nothing on import, so extraction workers can
+be started with ``forkserver`` and import only this, not the Flask app and its scheduler.
+"""
+import io
+
+import pdfplumber
+
+try:
+    import pypdfium2
+except ImportError:  # optional faster text backend
+    pypdfium2 = None
+
+
+def _pdfplumber_page_texts(pdf_bytes, page_numbers=None):
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        pages = pdf.pages if page_numbers is None else [pdf.pages[i] for i in page_numbers]
+        return [page.extract_text() or "" for page in pages]
+
+def _pypdfium2_page_texts(pdf_bytes, page_numbers=None):
+    pdf = pypdfium2.PdfDocument(pdf_bytes)
+    try:
+        texts = []
+        for i in range(len(pdf)) if page_numbers is None else page_numbers:
+            textpage = pdf[i].get_textpage()
+            texts.append(textpage.get_text_range())
+            textpage.close()
+        return texts
+    finally:
+        pdf.close()
+
+def _column_lines(page, tolerance=3, slack=2):
+    """Split a page into ``[prefix, on, from, to]`` cells using its header's word positions.
+
+    Returns ``None`` when the page has no ``Borough ... On ... From ... To`` header.
+    """
+    lines = []
+    for word in sorted(page.extract_words(), key=lambda w: (round(w["top"]), w["x0"])):
+        if lines and abs(word["top"] - lines[-1][0]["top"]) <= tolerance:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    bounds = None
+    for line in lines:
+        texts = [w["text"] for w in line]
+        if texts[0] == "Borough" and {"On", "From", "To"} <= set(texts):
+            bounds = [line[texts.index(name)]["x0"] - slack for name in ("On", "From", "To")]
+            break
+    if bounds is None:
+        return None
+    columns = []
+    for line in lines:
+        cells = [[], [], [], []]
+        for word in sorted(line, key=lambda w: w["x0"]):
+            cells[sum(word["x0"] >= b for b in bounds)].append(word["text"])
+        columns.append([" ".join(cell) for cell in cells])
+    return columns
+
+def _layout_page_columns(pdf_bytes, page_numbers=None):
+    # Pages without a recognisable header fall back to plain text for split_streets
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        pages = pdf.pages if page_numbers is None else [pdf.pages[i] for i in page_numbers]
+        return [_column_lines(page) or page.extract_text() or "" for page in pages]
+
+PDF_TEXT_BACKENDS = {
+    "pdfplumber": _pdfplumber_page_texts,
+    "pypdfium2": _pypdfium2_page_texts,
+    "layout": _layout_page_columns,
+}
+
+def available_pdf_text_backends():
+    return [name for name in PDF_TEXT_BACKENDS if name != "pypdfium2" or pypdfium2]
+
+# Set in each extraction worker so the PDF is handed over once, not pickled per chunk
+_worker_pdf = None
+
+def init_extract_worker(pdf_bytes, backend):
+    global _worker_pdf
+    _worker_pdf = (pdf_bytes, PDF_TEXT_BACKENDS[backend])
+
+def extract_chunk(page_numbers):
+    pdf_bytes, extract = _worker_pdf
+    return extract(pdf_bytes, page_numbers)
@@ -0,0 +1,73 @@
+// Draws a concrete-schedule FeatureCollection (see segments_geojson in app.py) on a Leaflet map.
+// Each borough gets its own toggleable layer; endpoints are clustered when
+// Leaflet.markercluster is loaded.
+function drawSchedule(map, collection) {
+  var colours = collection.colours || {};
+  function colour(props) {
+    return colours[props.boro] || "gray";
+  }
+  function popup(props) {
+    switch (props.kind) {
+      case "segment": return props.boro + ": " + props.on + " from " + props.from + " to " + props.to;
+      case "start": return "START: " + props.on + " & " + props.from;
+      case "end": return "END: " + props.on + " & " + props.to;
+      default: return props.boro + ": " + props.on + " at " + props.from + " (no end point found)";
+    }
+  }
+  function pointLayer(props, latlng) {
+    if (props.kind === "point" && L.AwesomeMarkers) {
+      // Same marker folium.Icon draws
+      return L.marker(latlng, {icon: L.AwesomeMarkers.icon({
+        icon: "info-sign", prefix: "glyphicon", markerColor: colour(props), iconColor: "white"
+      })});
+    }
+    if (props.kind === "point") {
+      return L.circleMarker(latlng, {
+        radius: 8, color: "white", weight: 2, fillColor: colour(props), fillOpacity: 0.9
+      });
+    }
+    return L.circleMarker(latlng, {
+      radius: 4, color: colour(props), fillColor: colour(props), fillOpacity: 0.9
+    });
+  }
+
+  var boroughs = {};
+  collection.features.forEach(function (feature) {
+    var props = feature.properties;
+    var coords = feature.geometry.coordinates;
+    var name = props.boro || "Unknown";
+    var borough = boroughs[name] || (boroughs[name] = {lines: [], points: []});
+    var layer;
+    if (feature.geometry.type === "LineString") {
+      layer = L.polyline(coords.map(function (c) { return [c[1], c[0]]; }), {
+        color: colour(props), weight: 6, opacity: 0.35
+      });
+      borough.lines.push(layer);
+    } else {
+      layer = pointLayer(props, L.latLng(coords[1], coords[0]));
+      borough.points.push(layer);
+    }
+    layer.bindPopup(popup(props));
+  });
+
+  var overlays = {};
+  Object.keys(boroughs).sort().forEach(function (name) {
+    var points = L.markerClusterGroup
+      ? L.markerClusterGroup({chunkedLoading: true, disableClusteringAtZoom: 15})
+      : L.featureGroup();
+    points.addLayers ? points.addLayers(boroughs[name].points) : boroughs[name].points.forEach(function (p) { points.addLayer(p); });
+    overlays[name] = L.featureGroup(boroughs[name].lines.concat([points])).addTo(map);
+  });
+  L.control.layers(null, overlays, {collapsed: false}).addTo(map);
+  return overlays;
+}
+
+function createScheduleMap(elementId) {
+  var map = L.map(elementId, {preferCanvas: true}).setView([40.7128, -74.0060], 11);
+  L.tileLayer("https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}{r}.png", {
+    attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
+    subdomains: "abcd",
+    maxZoom: 20
+  }).addTo(map);
+  return map;
+}
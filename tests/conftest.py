@@ -0,0 +1,106 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+# Import the app without starting the scheduler, and keep its cache out of the checkout
+os.environ.setdefault("PIPELINE_AUTOSTART", "0")
+os.environ.setdefault(
+    "GEOCODE_CACHE_FILE", os.path.join(tempfile.mkdtemp(prefix="concrete-map-tests-"), "geocode_cache.sqlite3")
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ArcGISStub(ThreadingHTTPServer):
+    """Local stand-in for an ArcGIS GeocodeServer.
+
+    ``candidates`` maps an address (SingleLine) to its ``(lat, lon)``; unknown addresses get
+    no candidates and addresses in ``errors`` get an embedded ``{"error": ...}`` body.
+    Batch requests answer with ``batch_status`` after ``batch_delay`` seconds.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), ArcGISStubHandler)
+        self.url = f"http://127.0.0.1:{self.server_port}/arcgis/rest/services/World/GeocodeServer"
+        self.candidates = {}
+        self.errors = {}
+        self.locator_properties = {}
+        self.batch_status = 200
+        self.batch_delay = 0
+        self.requests = []
+        self.connections = set()
+        self.lock = threading.Lock()
+
+
+class ArcGISStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is visible
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _record(self, operation, params):
+        with self.server.lock:
+            self.server.requests.append((operation, params))
+            self.server.connections.add(self.client_address)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        operation = url.path.rsplit("/", 1)[-1]
+        self._record(operation, params)
+        if operation == "findAddressCandidates":
+            address = params["SingleLine"]
+            if address in self.server.errors:
+                code, message = self.server.errors[address]
+                return self._reply({"error": {"code": code, "message": message}})
+            point = self.server.candidates.get(address)
+            if not point:
+                return self._reply({"candidates": []})
+            candidate = {"address": address, "score": 100, "location": {"x": point[1], "y": point[0]}}
+            return self._reply({"candidates": [candidate]})
+        self._reply({"locatorProperties": self.server.locator_properties})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        params = {k: v[0] for k, v in parse_qs(body).items()}
+        self._record(url.path.rsplit("/", 1)[-1], params)
+        time.sleep(self.server.batch_delay)
+        if self.server.batch_status != 200:
+            return self._reply({}, status=self.server.batch_status)
+        locations = []
+        for record in json.loads(params["addresses"])["records"]:
+            attributes = record["attributes"]
+            point = self.server.candidates.get(attributes["SingleLine"])
+            result = {"ResultID": attributes["OBJECTID"], "Status": "M" if point else "U"}
+            location = {"x": point[1], "y": point[0]} if point else {"x": "NaN", "y": "NaN"}
+            locations.append({"attributes": result, "location": location})
+        self._reply({"locations": locations})
+
+
+@pytest.fixture
+def arcgis_stub(monkeypatch):
+    import app
+
+    server = ArcGISStub()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(app, "ARCGIS_URL", server.url)
+    yield server
+    server.shutdown()
+    server.server_close()
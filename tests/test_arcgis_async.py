@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def backend(arcgis_stub):
+    backend = app.AsyncArcGISBackend(app.TokenBucket(1000), concurrency=4)
+    yield backend
+    backend.close()
+
+
+def intersection(street, cross="BROADWAY", boro="Manhattan"):
+    return app.Intersection.of(street, cross, boro)
+
+
+def test_returns_first_candidate(arcgis_stub, backend):
+    ix = intersection("W 4 ST")
+    arcgis_stub.candidates[ix.address] = (40.73, -74.0)
+    assert backend.geocode(ix) == (40.73, -74.0)
+    operation, params = arcgis_stub.requests[-1]
+    assert operation == "findAddressCandidates"
+    assert params["SingleLine"] == ix.address
+    assert params["f"] == "json"
+
+
+def test_no_candidates_is_none(backend):
+    assert backend.geocode(intersection("NOWHERE ST")) is None
+
+
+def test_embedded_error_body_raises(arcgis_stub, backend):
+    ix = intersection("W 4 ST")
+    arcgis_stub.errors[ix.address] = (498, "Invalid token")
+    with pytest.raises(app.ArcGISError) as excinfo:
+        backend.geocode(ix)
+    assert excinfo.value.code == 498
+    assert app.is_fatal(excinfo.value)
+
+
+def test_sequential_lookups_reuse_one_connection(arcgis_stub, backend):
+    for n in range(10):
+        backend.geocode(intersection(f"{n} AVE"))
+    assert len(arcgis_stub.requests) == 10
+    assert len(arcgis_stub.connections) == 1
+
+
+def test_concurrent_lookups_share_the_pool(arcgis_stub, backend):
+    streets = [f"{n} ST" for n in range(40)]
+    for street in streets:
+        arcgis_stub.candidates[intersection(street).address] = (40.0, -73.0)
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        points = list(pool.map(lambda street: backend.geocode(intersection(street)), streets))
+    assert points == [(40.0, -73.0)] * len(streets)
+    assert len(arcgis_stub.connections) <= 4
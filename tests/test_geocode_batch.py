@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+
+import app
+
+
+class FakeBatchBackend:
+    name = "fake-batch"
+    remote = True
+    batch_size = 150
+
+    def __init__(self):
+        self.breaker = app.CircuitBreaker(self.name)
+        self.batches = []
+
+    def geocode_batch(self, intersections):
+        self.batches.append(list(intersections))
+        return {intersection: (40.7, -73.8) for intersection in intersections}
+
+    def geocode(self, intersection):
+        return (40.7, -73.8)
+
+
+def run_pipeline(rows, backends, timeout=10):
+    """Run rows through planning and geocoding as generate_and_save_map does."""
+    placed = []
+
+    def run():
+        with app.GeocodeEngine(backends) as engine:
+            segments = app.plan_segments(app.threaded(iter(rows), "split_streets"), engine)
+            placed.extend(app.locate_segments(app.threaded(segments, "plan")))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline did not finish"
+    return placed
+
+
+def test_partial_batches_do_not_stall_the_pipeline():
+    # Far fewer unique misses than batch_size, spread over more rows than a stage queue holds
+    rows = [("Queens", f"STALL {n % 5} ST", "JAMAICA AVE", None) for n in range(400)]
+    backend = FakeBatchBackend()
+    placed = run_pipeline(rows, [backend])
+    assert len(placed) == 400
+    assert sum(len(batch) for batch in backend.batches) == 5
+
+
+def test_batches_follow_the_suggested_size(arcgis_stub):
+    arcgis_stub.locator_properties = {"SuggestedBatchSize": 10, "MaxBatchSize": 1000}
+    rows = [("Bronx", f"SIZED {n} ST", "GRAND CONCOURSE", None) for n in range(25)]
+    for n, (boro, on_st, from_st, _) in enumerate(rows[:-1]):
+        arcgis_stub.candidates[app.Intersection.of(on_st, from_st, boro).address] = (40.8 + n / 1000, -73.9)
+    backend = app.ArcGISBatchBackend(app.TokenBucket(1000))
+    placed = run_pipeline(rows, [backend])
+    batches = [
+        json.loads(params["addresses"])["records"]
+        for operation, params in arcgis_stub.requests if operation == "geocodeAddresses"
+    ]
+    # Waiting on a queued intersection may send a batch early, but never a bigger one
+    assert sum(len(batch) for batch in batches) == 25
+    assert max(len(batch) for batch in batches) <= 10
+    # The last row is unmatched ("U") and dropped; the rest come back in row order
+    assert [p[1] for p in placed] == [r[1] for r in rows[:-1]]
+    assert placed[3][4] == (40.803, -73.9)
+    assert not any(operation == "findAddressCandidates" for operation, _ in arcgis_stub.requests)
+
+
+def test_failed_batch_falls_back_to_single_lookups(arcgis_stub):
+    arcgis_stub.batch_status = 500
+    rows = [("Brooklyn", f"FALLBACK {n} ST", "FLATBUSH AVE", None) for n in range(4)]
+    for boro, on_st, from_st, _ in rows:
+        arcgis_stub.candidates[app.Intersection.of(on_st, from_st, boro).address] = (40.65, -73.95)
+    backend = app.ArcGISBatchBackend(app.TokenBucket(1000))
+    placed = run_pipeline(rows, [backend], timeout=30)
+    assert len(placed) == 4
+    singles = [params for operation, params in arcgis_stub.requests if operation == "findAddressCandidates"]
+    assert len(singles) == 4
+
+
+def test_fallback_for_the_last_batch_finishes_before_exit(arcgis_stub):
+    # The second row reuses a start that already came back empty, so nothing waits on its
+    # end; that end's batch is still failing when planning finishes and the engine exits
+    arcgis_stub.batch_status = 500
+    arcgis_stub.batch_delay = 0.4
+    arcgis_stub.candidates[app.Intersection.of("A ST", "D AVE", "Queens").address] = (40.7, -73.8)
+    backend = app.ArcGISBatchBackend(app.TokenBucket(1000))
+
+    def rows():
+        yield "Queens", "A ST", "B AVE", "C AVE"
+        time.sleep(1)
+        yield "Queens", "A ST", "B AVE", "D AVE"
+
+    placed = run_pipeline(rows(), [backend], timeout=30)
+    assert placed == []
+    singles = {
+        params["SingleLine"] for operation, params in arcgis_stub.requests if operation == "findAddressCandidates"
+    }
+    assert app.Intersection.of("A ST", "D AVE", "Queens").address in singles
+
+
+class DownBackend:
+    name = "down"
+    remote = True
+
+    def __init__(self):
+        self.breaker = app.CircuitBreaker(self.name)
+
+    def geocode(self, intersection):
+        if "NOWHERE" in intersection.address:
+            return None
+        raise ValueError("provider outage")
+
+
+def test_failed_lookups_are_counted_apart_from_no_result():
+    backend = DownBackend()
+    with app.GeocodeEngine([backend]) as engine:
+        missing = engine.submit(app.Intersection.of("NOWHERE ST", "EMPTY AVE", "Bronx"))
+        down = [engine.submit(app.Intersection.of(f"OUTAGE {n} ST", "DARK AVE", "Bronx")) for n in range(3)]
+    assert missing.result() is None
+    assert [future.result() for future in down] == [None] * 3
+    assert engine.failed == 3
@@ -0,0 +1,35 @@
+import pytest
+
+from app import split_streets
+
+# Expected triples are the output of the original per-word regex search,
+# " ST| STREET| AVE| ...$" with re.I, which split_streets must reproduce exactly.
+GOLDEN = [
+    ('BROADWAY  WEST 14 ST  WEST 23 ST', ['BROADWAY', 'WEST 14 ST', 'WEST 23 ST']),
+    ('5 AVE EAST 14 ST EAST 23 STREET', ['5 AVE', 'EAST 14 ST', 'EAST 23 STREET']),
+    ('ST NICHOLAS AVE WEST 145 ST WEST 155 ST', ['ST NICHOLAS AVE', 'WEST 145 ST', 'WEST 155 ST']),
+    ('MAIN ST OAK ST', ['MAIN ST', 'OAK ST', '']),
+    ('MAIN ST', ['MAIN ST', '', '']),
+    ('OCEAN PKWY AVENUE J AVENUE K', ['OCEAN PKWY', 'AVENUE J AVENUE', 'K']),
+    ('FLATBUSH Ave CHURCH Ave BEVERLY Rd', ['FLATBUSH Ave', 'CHURCH Ave', 'BEVERLY Rd']),
+    ('NORTHERN BLVD 82 ST 90 ST 94 ST', ['NORTHERN BLVD', '82 ST', '90 ST']),
+    ('PARK PL  CLASSON AVE', ['PARK PL', 'CLASSON AVE', '']),
+    ('W 4 ST SIXTH AVENUE WAVERLY PL', ['W 4 ST', 'SIXTH AVENUE', 'WAVERLY PL']),
+    ('BROADWAY WAY MAIN ST', ['BROADWAY WAY', 'MAIN ST', '']),
+    ('SHORE DRIVE BAY RIDGE PARKWAY 3 AVE', ['SHORE DRIVE', 'BAY RIDGE PARKWAY', '3 AVE']),
+    ('CROSS BAY BLVD', ['CROSS BAY BLVD', '', '']),
+    ('QUEENS BOULEVARD  JACKSON AVE', ['QUEENS BOULEVARD', 'JACKSON AVE', '']),
+    ('BROADWAY', ['BROADWAY', '', '']),
+    ('', ['', '', '']),
+    ('MAIN ﬆ OAK ST ELM ST', ['MAIN ﬆ OAK ST', 'ELM ST', '']),
+    ('MAIN ſT OAK ST ELM ST', ['MAIN ſT', 'OAK ST', 'ELM ST']),
+    ('KING CT QUEEN ct', ['KING CT', 'QUEEN ct', '']),
+    ('EAST 7 STREET EXT AVENUE U AVENUE X', ['EAST 7 STREET', 'EXT AVENUE', 'U AVENUE']),
+    ('METROPOLITAN AVE  GRAND ST  ', ['METROPOLITAN AVE', 'GRAND ST', '']),
+    ('ST JOHNS PL NOSTRAND AVE ROGERS AVE', ['ST JOHNS PL', 'NOSTRAND AVE', 'ROGERS AVE']),
+]
+
+
+@pytest.mark.parametrize("block, expected", GOLDEN)
+def test_split_streets_matches_original(block, expected):
+    assert split_streets(block) == expected